@@ -7,9 +7,8 @@ Provides functions for generating ordering strings
 
 
 """
-from math import floor
+from functools import lru_cache
 from typing import Optional, List
-import decimal
 
 
 __version__ = '0.1.3'
@@ -17,6 +16,81 @@ __licence__ = 'CC0 1.0 Universal'
 
 BASE_62_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
 
+BASE_62_INDEX = {c: i for i, c in enumerate(BASE_62_DIGITS)}
+
+_B62_ZERO = BASE_62_DIGITS[0]
+_B62_SMALLEST = 'A' + _B62_ZERO * 26
+
+_SMALLEST_KEYS = {BASE_62_DIGITS: _B62_SMALLEST}
+
+
+def _get_smallest_key(digits: str) -> str:
+    """The smallest (invalid) integer key for `digits`, built once."""
+    try:
+        return _SMALLEST_KEYS[digits]
+    except KeyError:
+        smallest = _SMALLEST_KEYS[digits] = 'A' + digits[0] * 26
+        return smallest
+
+
+_DIGIT_INDEXES = {BASE_62_DIGITS: BASE_62_INDEX}
+
+
+def _get_digit_index(digits: str) -> dict:
+    """
+    Char -> position lookup table for `digits`, built once per alphabet.
+    A dict subscript is much cheaper than the linear scan done by
+    `str.index()`, which matters in the per-digit loops below.
+
+    """
+    try:
+        return _DIGIT_INDEXES[digits]
+    except KeyError:
+        index = _DIGIT_INDEXES[digits] = {c: i for i, c in enumerate(digits)}
+        return index
+
+
+_DIGIT_TABLES = {}
+
+
+def _get_digit_tables(digits: str) -> Optional[tuple]:
+    """
+    `(digits_bytes, index_bytes)` for alphabets that fit in latin-1, or
+    None otherwise.  Having both tables lets the integer-part arithmetic
+    run over a single mutable bytearray instead of a list of one-char
+    strings that has to be join()ed back together.
+
+    """
+    try:
+        return _DIGIT_TABLES[digits]
+    except KeyError:
+        pass
+    try:
+        digits_b = digits.encode('latin-1')
+    except UnicodeEncodeError:
+        tables = None
+    else:
+        if len(digits_b) >= 255:
+            # 0xFF must stay free as the invalid-byte sentinel below
+            tables = None
+        else:
+            # bytes outside the alphabet map to an out-of-range sentinel
+            # so that malformed keys raise instead of being read as the
+            # zero digit
+            index_b = bytearray(b'\xff' * 256)
+            for i, byte in enumerate(digits_b):
+                index_b[byte] = i
+            tables = digits_b, bytes(index_b)
+    _DIGIT_TABLES[digits] = tables
+    return tables
+
+
+_B62_TABLES = _get_digit_tables(BASE_62_DIGITS)
+
+# head-character code points for the carry/borrow boundary checks
+_ORD_UPPER_A, _ORD_UPPER_Z = ord('A'), ord('Z')
+_ORD_LOWER_A, _ORD_LOWER_Z = ord('a'), ord('z')
+
 
 class FIError(Exception):
     pass
@@ -36,44 +110,53 @@ def midpoint(a: str, b: Optional[str], digits: str) -> str:
         raise FIError(f'{a} >= {b}')
     if (a and a[-1]) == zero or (b is not None and b[-1] == zero):
         raise FIError('trailing zero')
+    index = BASE_62_INDEX if digits is BASE_62_DIGITS else _get_digit_index(digits)
+    base = len(digits)
+    la = len(a)
+    # skip the longest common prefix.  conceptually `a` is padded with 0s
+    # as we go; we don't need to pad `b`, because it can't end before `a`
+    # while traversing the common prefix.
+    i = 0
     if b:
-        # remove longest common prefix.  pad `a` with 0s as we
-        # go.  note that we don't need to pad `b`, because it can't
-        # end before `a` while traversing the common prefix.
-        n = 0
-        for x, y in zip(a.ljust(len(b), zero), b):
-            if x == y:
-                n += 1
-                continue
-            break
-
-        if n > 0:
-            return b[:n] + midpoint(a[n:], b[n:], digits)
-
-    # first digits (or lack of digit) are different
-    try:
-        digit_a = digits.index(a[0]) if a else 0
-    except IndexError:
-        digit_a = -1
-    try:
-        digit_b = digits.index(b[0]) if b is not None else len(digits)
-    except IndexError:
-        digit_b = -1
-
-    if digit_b - digit_a > 1:
-        min_digit = round_half_up(0.5 * (digit_a + digit_b))
-        return digits[min_digit]
+        lb = len(b)
+        shorter = la if la < lb else lb
+        while i < shorter and a[i] == b[i]:
+            i += 1
+        if i == la:
+            # `a` is exhausted; its implicit padding only matches zeros
+            while i < lb and b[i] == zero:
+                i += 1
+    prefix = b[:i] if i else ''
+
+    # digits (or lack of digit) past the prefix are different.  in the
+    # common case the answer is the prefix plus a single digit, so try
+    # that first without building a parts list
+    digit_a = index[a[i]] if i < la else 0
+    if b is None:
+        digit_b = base
     else:
-        if b is not None and len(b) > 1:
-            return b[:1]
-        else:
-            # `b` is null or has length 1 (a single digit).
-            # the first digit of `a` is the previous digit to `b`,
-            # or 9 if `b` is null.
-            # given, for example, midpoint('49', '5'), return
-            # '4' + midpoint('9', null), which will become
-            # '4' + '9' + midpoint('', null), which is '495'
-            return digits[digit_a] + midpoint(a[1:], None, digits)
+        digit_b = index[b[i]] if i < len(b) else -1
+    if digit_b - digit_a > 1:
+        # round-half-up midpoint of two small non-negative ints
+        return prefix + digits[(digit_a + digit_b + 1) // 2]
+    if b is not None and len(b) - i > 1:
+        return prefix + b[i]
+
+    # `b` is null or has a single digit left.  the digit of `a` is
+    # the previous digit to `b`, or 9 if `b` is null.
+    # given, for example, midpoint('49', '5'), emit '4' and carry on
+    # as midpoint('9', null), which will become
+    # '4' + '9' + midpoint('', null), which is '495'.  from here on `b`
+    # plays no part, so each further step only looks at `a`
+    parts = [digits[digit_a]]
+    while True:
+        i += 1
+        digit_a = index[a[i]] if i < la else 0
+        if base - digit_a > 1:
+            parts.append(digits[(digit_a + base + 1) // 2])
+            break
+        parts.append(digits[digit_a])
+    return prefix + ''.join(parts)
 
 
 def validate_integer(i: str):
@@ -81,14 +164,26 @@ def validate_integer(i: str):
         raise FIError(f'invalid integer part of order key: {i}')
 
 
+# integer-part length per head character, 0 marking an invalid head:
+# 'a'..'z' count up from 2, 'A'..'Z' count down to 2
+_INT_LEN = bytearray(128)
+for _c in range(ord('a'), ord('z') + 1):
+    _INT_LEN[_c] = _c - ord('a') + 2
+for _c in range(ord('A'), ord('Z') + 1):
+    _INT_LEN[_c] = ord('Z') - _c + 2
+_INT_LEN = bytes(_INT_LEN)
+del _c
+
+
 def get_integer_length(head):
-    if 'a' <= head <= 'z':
-        return ord(head) - ord('a') + 2
-    elif 'A' <= head <= 'Z':
-        return ord('Z') - ord(head[0]) + 2
-    raise FIError('invalid order key head: ' + head)
+    o = ord(head)
+    length = _INT_LEN[o] if o < 128 else 0
+    if not length:
+        raise FIError('invalid order key head: ' + head)
+    return length
 
 
+@lru_cache(maxsize=4096)
 def get_integer_part(key: str) -> str:
     integer_part_length = get_integer_length(key[0])
     if integer_part_length > len(key):
@@ -97,28 +192,89 @@ def get_integer_part(key: str) -> str:
 
 
 def validate_order_key(key: str, digits=BASE_62_DIGITS):
-    zero = digits[0]
-    smallest = 'A' + (zero * 26)
-    if key == smallest:
-        raise FIError(f'invalid order key: {key}')
+    _parse_order_key(key, digits)
+
+
+@lru_cache(maxsize=4096)
+def _parse_order_key(key: str, digits: str) -> tuple:
+    """
+    Validate `key` and split it into its (integer part, fractional part)
+    pair in a single pass: head lookup, length check, trailing-zero
+    check and smallest-key check all happen here, once per unique key.
 
-    # get_integer_part() will throw if the first character is bad,
-    # or the key is too short.  we'd call it to check these things
-    # even if we didn't need the result
-    i = get_integer_part(key)
-    f = key[len(i):]
-    if f and f[-1] == zero:
+    """
+    o = ord(key[0])
+    length = _INT_LEN[o] if o < 128 else 0
+    if length == 0:
+        raise FIError('invalid order key head: ' + key[0])
+    if length > len(key):
         raise FIError(f'invalid order key: {key}')
+    zero = digits[0]
+    integer_part = key[:length]
+    fraction_part = key[length:]
+    if fraction_part:
+        if fraction_part[-1] == zero:
+            raise FIError(f'invalid order key: {key}')
+    else:
+        if digits is BASE_62_DIGITS:
+            smallest = _B62_SMALLEST
+        else:
+            smallest = _get_smallest_key(digits)
+        if integer_part == smallest:
+            raise FIError(f'invalid order key: {key}')
+    return integer_part, fraction_part
 
 
 def increment_integer(x: str, digits: str) -> Optional[str]:
-    zero = digits[0]
     validate_integer(x)
+    return _increment_integer(x, digits)
+
+
+def _increment_integer(x: str, digits: str) -> Optional[str]:
+    # `x` is a known-good integer part; callers that already went
+    # through _parse_order_key() or validate_integer() skip revalidation
+    tables = _B62_TABLES if digits is BASE_62_DIGITS else _get_digit_tables(digits)
+    if tables is None:
+        return _increment_integer_generic(x, digits)
+    digits_b, index_b = tables
+    base = len(digits_b)
+    zero_b = digits_b[0]
+    buf = bytearray(x.encode('latin-1'))
+    head = buf[0]
+    carry = True
+    i = len(buf) - 1
+    while i > 0:
+        d = index_b[buf[i]] + 1
+        if d == base:
+            buf[i] = zero_b
+            i -= 1
+        else:
+            buf[i] = digits_b[d]
+            carry = False
+            break
+    if carry:
+        if head == _ORD_UPPER_Z:
+            return 'a' + digits[0]
+        if head == _ORD_LOWER_Z:
+            return None
+        head += 1
+        if head > _ORD_LOWER_A:
+            buf.append(zero_b)
+        else:
+            del buf[-1]
+        buf[0] = head
+    return buf.decode('latin-1')
+
+
+def _increment_integer_generic(x: str, digits: str) -> Optional[str]:
+    zero = digits[0]
+    index = _get_digit_index(digits)
+    base = len(digits)
     head, *digs = x
     carry = True
     for i in reversed(range(len(digs))):
-        d = digits.index(digs[i]) + 1
-        if d == len(digits):
+        d = index[digs[i]] + 1
+        if d == base:
             digs[i] = zero
         else:
             digs[i] = digits[d]
@@ -141,16 +297,48 @@ def increment_integer(x: str, digits: str) -> Optional[str]:
 
 def decrement_integer(x, digits):
     validate_integer(x)
-    head, *digs = x
+    return _decrement_integer(x, digits)
+
+
+def _decrement_integer(x, digits):
+    tables = _B62_TABLES if digits is BASE_62_DIGITS else _get_digit_tables(digits)
+    if tables is None:
+        return _decrement_integer_generic(x, digits)
+    digits_b, index_b = tables
+    top_b = digits_b[-1]
+    buf = bytearray(x.encode('latin-1'))
+    head = buf[0]
     borrow = True
-    for i in reversed(range(len(digs))):
+    i = len(buf) - 1
+    while i > 0:
+        d = index_b[buf[i]] - 1
+        if d == -1:
+            buf[i] = top_b
+            i -= 1
+        else:
+            buf[i] = digits_b[d]
+            borrow = False
+            break
+    if borrow:
+        if head == _ORD_LOWER_A:
+            return 'Z' + digits[-1]
+        if head == _ORD_UPPER_A:
+            return None
+        head -= 1
+        if head < _ORD_UPPER_Z:
+            buf.append(top_b)
+        else:
+            del buf[-1]
+        buf[0] = head
+    return buf.decode('latin-1')
 
-        try:
-            index = digits.index(digs[i])
-        except IndexError:
-            index = -1
-        d = index - 1
 
+def _decrement_integer_generic(x, digits):
+    index = _get_digit_index(digits)
+    head, *digs = x
+    borrow = True
+    for i in reversed(range(len(digs))):
+        d = index[digs[i]] - 1
         if d == -1:
             digs[i] = digits[-1]
         else:
@@ -181,41 +369,54 @@ def generate_key_between(a: Optional[str], b: Optional[str], digits=BASE_62_DIGI
     ascending character code order!
 
     """
-    zero = digits[0]
-    if a is not None:
-        validate_order_key(a, digits=digits)
-    if b is not None:
-        validate_order_key(b, digits=digits)
+    # the plain string comparison is far cheaper than validation, so
+    # reject misordered input before doing any parsing
     if a is not None and b is not None and a >= b:
         raise FIError(f'{a} >= {b}')
+    if digits is BASE_62_DIGITS:
+        return _key_between_base_62(a, b)
+    return _key_between(a, b, digits)
+
+
+@lru_cache(maxsize=2048)
+def _key_between_base_62(a: Optional[str], b: Optional[str]) -> str:
+    # generate_key_between() is pure, so for the default alphabet the
+    # midpoint of an already-seen (a, b) pair is just a cache hit --
+    # common when overlapping ranges are regenerated
+    return _key_between(a, b, BASE_62_DIGITS)
 
+
+def _key_between(a: Optional[str], b: Optional[str], digits: str) -> str:
+    # validation happens as a side effect of _parse_order_key() below,
+    # so each input key is checked and split in one (cached) pass
+    zero = digits[0]
     if a is None:
         if b is None:
             return 'a' + zero
-        ib = get_integer_part(b)
-        fb = b[len(ib):]
-        if ib == 'A' + (zero * 26):
+        ib, fb = _parse_order_key(b, digits)
+        if digits is BASE_62_DIGITS:
+            smallest = _B62_SMALLEST
+        else:
+            smallest = _get_smallest_key(digits)
+        if ib == smallest:
             return ib + midpoint('', fb, digits)
         if ib < b:
             return ib
-        res = decrement_integer(ib, digits)
+        res = _decrement_integer(ib, digits)
         if res is None:
             raise FIError('cannot decrement any more')
         return res
 
     if b is None:
-        ia = get_integer_part(a)
-        fa = a[len(ia):]
-        i = increment_integer(ia, digits)
+        ia, fa = _parse_order_key(a, digits)
+        i = _increment_integer(ia, digits)
         return ia + midpoint(fa, None, digits) if i is None else i
 
-    ia = get_integer_part(a)
-    fa = a[len(ia):]
-    ib = get_integer_part(b)
-    fb = b[len(ib):]
+    ia, fa = _parse_order_key(a, digits)
+    ib, fb = _parse_order_key(b, digits)
     if ia == ib:
         return ia + midpoint(fa, fb, digits)
-    i = increment_integer(ia, digits)
+    i = _increment_integer(ia, digits)
     if i is None:
         raise FIError('cannot increment any more')
 
@@ -239,47 +440,96 @@ def generate_n_keys_between(a: Optional[str], b: Optional[str], n: int, digits=B
         return []
     if n == 1:
         return [generate_key_between(a, b, digits)]
+    result = [None] * n
     if b is None:
-        c = generate_key_between(a, b, digits)
-        result = [c]
-        for i in range(n - 1):
+        c = a
+        for i in range(n):
             c = generate_key_between(c, b, digits)
-            result.append(c)
+            result[i] = c
         return result
 
     if a is None:
-        c = generate_key_between(a, b, digits)
-        result = [c]
-        for i in range(n - 1):
+        c = b
+        for i in range(n - 1, -1, -1):
             c = generate_key_between(a, c, digits)
-            result.append(c)
-        return list(reversed(result))
-
-    mid = floor(n / 2)
-    c = generate_key_between(a, b, digits)
-    return [
-        *generate_n_keys_between(a, c, mid, digits),
-        c,
-        *generate_n_keys_between(c, b, n - mid - 1, digits)
-    ]
+            result[i] = c
+        return result
 
+    # both bounds present: same early ordering check as
+    # generate_key_between(), then pick a strategy
+    if a >= b:
+        raise FIError(f'{a} >= {b}')
+    ia, fa = _parse_order_key(a, digits)
+    ib, fb = _parse_order_key(b, digits)
+    if ia == ib:
+        # both bounds live under the same integer part, so the keys can
+        # be emitted in one linear pass instead of a midpoint tree
+        return _n_keys_linear(ia, fa, fb, n, digits)
+
+    # fill midpoints iteratively rather than recursing: each pending
+    # (lo, hi) slice gets its middle key from its bounding keys, then
+    # its two halves go back on the stack.  this fills the preallocated
+    # result in place instead of splatting sublists together per level
+    stack = [(0, n, a, b)]
+    while stack:
+        lo, hi, lower, upper = stack.pop()
+        mid = lo + (hi - lo) // 2
+        c = generate_key_between(lower, upper, digits)
+        result[mid] = c
+        if mid + 1 < hi:
+            stack.append((mid + 1, hi, c, upper))
+        if lo < mid:
+            stack.append((lo, mid, lower, c))
+    return result
+
+
+def _n_keys_linear(ia: str, fa: str, fb: str, n: int, digits: str) -> List[str]:
+    """
+    Emit `n` evenly spaced keys strictly between the keys `ia + fa` and
+    `ia + fb`.  The fractional parts are read as base-len(digits)
+    numerals, the gap is divided into n + 1 steps (widening the
+    precision until every step is non-zero), and each key is encoded by
+    repeated addition -- constant work per key instead of one midpoint
+    tree descent per key.
 
-def round_half_up(n: float) -> int:
     """
-    >>> round_half_up(0.4)
-    0
-    >>> round_half_up(0.8)
-    1
-    >>> round_half_up(0.5)
-    1
-    >>> round_half_up(1.5)
-    2
-    >>> round_half_up(2.5)
-    3
+    index = BASE_62_INDEX if digits is BASE_62_DIGITS else _get_digit_index(digits)
+    base = len(digits)
+    zero = digits[0]
+    length = max(len(fa), len(fb))
+    a_int = 0
+    for c in fa:
+        a_int = a_int * base + index[c]
+    a_int *= base ** (length - len(fa))
+    b_int = 0
+    for c in fb:
+        b_int = b_int * base + index[c]
+    b_int *= base ** (length - len(fb))
+    # widen until there is room for n distinct keys between the bounds
+    while b_int - a_int <= n:
+        length += 1
+        a_int *= base
+        b_int *= base
+    step = (b_int - a_int) // (n + 1)
+    result = [None] * n
+    value = a_int
+    for k in range(n):
+        value += step
+        v = value
+        chars = [zero] * length
+        for j in range(length - 1, -1, -1):
+            v, r = divmod(v, base)
+            chars[j] = digits[r]
+        result[k] = ia + ''.join(chars).rstrip(zero)
+    return result
+
+
+def clear_cache():
+    """
+    Drop the internal memoization caches.  Handy for long-running
+    services that want to cap memory between large batches.
+
     """
-    return int(
-        decimal.Decimal(str(n)).quantize(
-            decimal.Decimal('1'),
-            rounding=decimal.ROUND_HALF_UP
-        )
-    )
+    _key_between_base_62.cache_clear()
+    _parse_order_key.cache_clear()
+    get_integer_part.cache_clear()
@@ -66,6 +66,19 @@ def test_generate_n_keys_between(a: Optional[str], b: Optional[str], n: int, exp
     assert act == expected
 
 
+def test_generate_n_keys_between_same_integer_part():
+    # bounds sharing an integer part take the linear, evenly-spaced path
+    # rather than midpoint subdivision
+    assert generate_n_keys_between('a01', 'a02', 3, '0123456789') == ['a012', 'a014', 'a016']
+
+    keys = generate_n_keys_between('a0V', 'a0W', 100)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == 100
+    for key in keys:
+        validate_order_key(key)
+        assert 'a0V' < key < 'a0W'
+
+
 @pytest.mark.parametrize(['a', 'b', 'expected'], [
     ('a00', 'a01', 'a00P'),
     ('a0/', 'a00', 'a0/P'),
@@ -100,6 +113,22 @@ def test_base95_digits(a: Optional[str], b: Optional[str], expected: str) -> Non
         assert act == expected
 
 
+def test_integer_midpoint_rounds_half_up():
+    # `(a + b + 1) // 2` replaced the Decimal-based round_half_up() in
+    # midpoint(); they must agree for every digit pair midpoint() can see.
+    import decimal
+
+    def round_half_up(n: float) -> int:
+        return int(decimal.Decimal(str(n)).quantize(
+            decimal.Decimal('1'),
+            rounding=decimal.ROUND_HALF_UP,
+        ))
+
+    for a in range(63):
+        for b in range(a + 1, 63):
+            assert (a + b + 1) // 2 == round_half_up(0.5 * (a + b))
+
+
 def test_readme_examples_single_key():
     # Insert at the beginning
     first = generate_key_between(None, None)